@@ -27,10 +27,17 @@ import argparse
 import os
 import sys
 import json
-import uuid
+import pickle
 import shutil
 import glob
+import functools
+import hashlib
+import io
+import itertools
 import typing as T
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
+from concurrent.futures import ProcessPoolExecutor
 
 vs_header_tmpl = """<?xml version="1.0" ?>
 <Project xmlns="http://schemas.microsoft.com/developer/msbuild/2003" DefaultTargets="Build">
@@ -113,6 +120,17 @@ vs_end_proj_tmpl = """\t<Import Project="$(VCTargetsPath)\Microsoft.Cpp.targets"
 vs_start_filter = """<?xml version="1.0" encoding="utf-8"?>
 <Project ToolsVersion="4.0" xmlns="http://schemas.microsoft.com/developer/msbuild/2003">\n"""
 
+vs_filter_tmpl = """\t\t<Filter Include="{path}">
+\t\t\t<UniqueIdentifier>{{{guid}}}</UniqueIdentifier>
+\t\t</Filter>\n"""
+
+vs_include_props_tmpl = """<?xml version="1.0" encoding="utf-8"?>
+<Project xmlns="http://schemas.microsoft.com/developer/msbuild/2003">
+\t<PropertyGroup>
+\t\t<NinjaVsIncludePath>{include_paths}</NinjaVsIncludePath>
+\t</PropertyGroup>
+</Project>\n"""
+
 vs_include_meson_options = """\t<ItemGroup>
 \t\t<PropertyPageSchema Include="meson_options.xml">
 \t\t\t<Context>Project</Context>
@@ -126,9 +144,26 @@ vs_meson_options_rule = """<?xml version="1.0" encoding="utf-8"?>
 \t</Rule.DataSource>
 """
 
+parallel_sleep_tmpl = """
+import time;
+import os;
+import sys;
+def count_files():
+    with os.scandir("{tmp_dir}") as it:
+        return sum(1 for _ in it)
+open(f"{tmp_dir}/{{sys.argv[1]}}", "w").close()
+count = count_files()
+if count < 2:
+    time.sleep(0.5)
+    count = count_files()
+sys.exit(count)
+"""
+
 directory_guid = '{2150E333-8FDC-42A3-9474-1A3956D46DE8}'
 cpp_guid = '{8BC9CEB8-8B4A-11D0-8D11-00A0C91BC942}'
 
+sln_project_tmpl = 'Project("{type_guid}") = "{name}", "{id}.vcxproj", "{{{guid}}}"\n{deps}EndProject\n'
+
 SET_VSCMD_VER='if not defined VSCMD_VER (set VSCMD_VER=%VISUALSTUDIOVERSION%)'
 NINJA_CMD = f'{SET_VSCMD_VER} &amp;&amp; ninja'
 
@@ -164,55 +199,79 @@ def get_headers(intro):
     target_headers = {}
     for target in targets:
         target_headers[f'{target["name"]}'] = set()
-    # Ask list of headers used in object from ninja
-    object_deps = (
-        subprocess.check_output(['ninja', '-C', str(build_dir), '-t', 'deps'])
-        .decode('utf-8')
-        .replace('\r', '\n')
-        .strip()
-        .split('\n\n\n\n')
-    )
-    for dep in object_deps:
-        object_name = re.match('^.*(?=: )', dep)
-        if object_name == None:
-            continue
-        object_name = object_name.group(0)
-        # Get project name in which object is included. This could use better matching if there are
-        # multiple projects with same name in different folders
-        target_proj = None
-        for target_name, headers in target_headers.items():
-            if re.match(f'.*{target_name}.*[\\/].*', object_name):
-                target_proj = target_name
-                break
-        if target_proj == None:
-            continue
-        # Add headers to target
-        headers = re.search('  (.|\n)*', dep)
-        if headers != None:
-            headers = headers.group(0).split()
-            for h in headers:
-                target_headers[target_name].add(Path(h))
-    # Filter out headers that are not in source directory
+    if not target_headers:
+        return {}
+    # One pattern for all targets so each object is searched only once. Longer names are first so
+    # that a target is not matched by another target whose name is a prefix of it
+    target_re = re.compile('|'.join(re.escape(name) for name in sorted(target_headers, key=len, reverse=True)).encode('utf-8'))
+    # Ask list of headers used in object from ninja. The output can be very large so it is read
+    # line by line as bytes and every distinct header is decoded only once
+    object_headers = None
+    with subprocess.Popen(['ninja', '-C', str(build_dir), '-t', 'deps'], stdout=subprocess.PIPE) as ninja:
+        for line in ninja.stdout:
+            # Headers are indented below the object they belong to
+            if line[:1].isspace():
+                if object_headers is not None:
+                    object_headers.update(line.split())
+                continue
+            # Record starts with "object: #deps N, deps mtime M (VALID)" line followed by the headers
+            object_name, sep, _ = line.partition(b': ')
+            object_headers = None
+            if not sep:
+                continue
+            # Get project name in which object is included. This could use better matching if there are
+            # multiple projects with same name in different folders
+            target_proj = target_re.search(os.path.dirname(object_name))
+            if target_proj != None:
+                object_headers = target_headers[target_proj.group(0).decode('utf-8')]
+    if ninja.returncode != 0:
+        raise subprocess.CalledProcessError(ninja.returncode, ninja.args)
+    # Filter out headers that are not in source directory. Most of the headers are system headers
+    # so a plain string comparison is used for the check before touching the filesystem
+    build_dir_str = str(build_dir)
+    src_prefix = os.path.normcase(dir_prefix(source_dir.absolute()))
     filt_target_headers = {}
     for target, headers in target_headers.items():
         filt_headers = []
         for h in headers:
-            try:
-                h_path = (build_dir / h).absolute().resolve()
-                if (source_dir / h_path.relative_to(source_dir)).exists():
-                    filt_headers.append(h_path.absolute().resolve())
-            except ValueError:
-                pass
-        filt_target_headers[target] = filt_headers
+            h_path = os.path.abspath(os.path.join(build_dir_str, h.decode('utf-8')))
+            if os.path.normcase(h_path).startswith(src_prefix) and is_file(h_path):
+                filt_headers.append(h_path)
+        # Sorted because the headers come from a set whose order changes between runs
+        filt_target_headers[target] = sorted(filt_headers)
     return filt_target_headers
 
 
-def generate_guid():
-    return str(uuid.uuid4()).upper()
+def dir_prefix(dir):
+    return os.path.join(os.path.normpath(dir), '')
+
+
+def relpath_in_dir(path, prefix):
+    # Faster than os.path.relpath for the common case where the path is inside the directory.
+    # The prefix is the normalized directory with a trailing separator from dir_prefix()
+    path = os.path.normpath(path)
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return os.path.relpath(path, prefix)
+
+
+@functools.lru_cache(maxsize=None)
+def is_file(path):
+    # Same headers are included by many targets so each of them is checked only once
+    return os.path.isfile(path)
 
 
+def write_utf8(path, parts: T.List[str]):
+    # Encode the whole file at once instead of every small write separately
+    with open(path, 'wb') as f:
+        f.write(''.join(parts).encode('utf-8'))
+
+
+@functools.lru_cache(maxsize=None)
 def generate_guid_from_path(path):
-    return str(uuid.uuid5(uuid.NAMESPACE_URL, str(path))).upper()
+    # The GUIDs only need to be stable and unique within the solution so a fast hash is enough
+    h = hashlib.blake2b(str(path).encode('utf-8'), digest_size=16).hexdigest().upper()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
 
 
 def get_introspect_files(build_dir) -> dict:
@@ -228,16 +287,30 @@ def get_introspect_files(build_dir) -> dict:
     intro['targets'] = prefix / 'intro-targets.json'
     intro['tests'] = prefix / 'intro-tests.json'
     intro['meson_info'] = prefix / 'meson-info.json'
+    # Decoding the introspection files is slow for large projects so the result is cached until any
+    # of the files, this script or the Python version changes
+    signature = [sys.version_info[:2], os.stat(__file__).st_mtime_ns]
     for key, path in intro.items():
         if not (path.exists()):
             raise Exception(f"Introspect data {path} missing!. Unable to generate Visual Studio solutions.")
-        intro[key] = json.load(open(intro[key]))
+        stat = path.stat()
+        signature.append((key, stat.st_mtime_ns, stat.st_size))
+    cache_path = build_dir / 'ninja_vs_private' / 'intro.pickle'
+    try:
+        with open(cache_path, 'rb') as f:
+            if pickle.load(f) == signature:
+                return pickle.load(f)
+    except Exception:
+        # The cache is only an optimization so any problem reading it falls back to the JSON files
+        pass
+    for key, path in intro.items():
+        with open(path) as f:
+            intro[key] = json.load(f)
     # Modify build target ids so that the VS projects are created in correct subfolder
-    src_dir = intro['meson_info']['directories']['source']
+    src_prefix = dir_prefix(intro['meson_info']['directories']['source'])
     for target in intro['targets']:
-        target_dir = Path(os.path.dirname(target['defined_in']))
-        prefix = target_dir.relative_to(src_dir)
-        target['id'] = str(prefix / target['id'])
+        target_dir = os.path.dirname(relpath_in_dir(target['defined_in'], src_prefix))
+        target['id'] = os.path.join(target_dir, target['id'])
     buildoptions = {}
     for opt in intro['buildoptions']:
         buildoptions[opt['name']] = opt
@@ -248,15 +321,20 @@ def get_introspect_files(build_dir) -> dict:
         intro['buildoptions']['cpp_std']['value'] = 'std' + intro['buildoptions']['cpp_std']['value'].replace('none', 'Default').replace('+', 'p')
     if 'c_std' in intro['buildoptions']:
         intro['buildoptions']['c_std']['value'] = 'std' + intro['buildoptions']['c_std']['value'].replace('none', 'Default')
+    cache_path.parent.mkdir(exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        # Fixed protocol so that every supported Python version can read the cache
+        pickle.dump(signature, f, 4)
+        pickle.dump(intro, f, 4)
     return intro
 
 
 def get_meson_command(build_dir):
+    # The rule is near the top of build.ninja so the file is read only until it is found
     with open(Path(build_dir) / 'build.ninja', 'r') as f:
-        lines = f.readlines()
-        for i in range(len(lines)):
-            if lines[i] == "rule REGENERATE_BUILD\n":
-                command = lines[i + 1].split()
+        for line in f:
+            if line == "rule REGENERATE_BUILD\n":
+                command = next(f).split()
                 start = command.index("=") + 1
                 # Sometimes the --internal flag is quoted and sometimes not
                 for i in range(len(command)):
@@ -271,12 +349,15 @@ def get_arch(build_dir, private_dir):
     platform_arch_txt = Path(private_dir) / 'platform_arch.txt'
     if platform_arch_txt.exists():
         return platform_arch_txt.read_text()
+    # The line is near the top of the log so the rest of the file is not read
+    host_cpu = 'Host machine cpu: '
     with open(Path(build_dir) / 'meson-logs/meson-log.txt', 'r') as f:
-        txt = f.read()
-        arch = re.search("(?<=(Host machine cpu: )).*$", txt, re.MULTILINE)
-        if arch != None:
-            platform_arch_txt.write_text(arch.group(0))
-            return arch.group(0)
+        for line in f:
+            start = line.find(host_cpu)
+            if start != -1:
+                arch = line[start + len(host_cpu) :].rstrip('\n')
+                platform_arch_txt.write_text(arch)
+                return arch
     raise Exception("Unable to find machine architecture from meson-log.txt")
 
 def get_platform_toolset(intro : dict) -> str:
@@ -298,23 +379,20 @@ def run_reconfigure(build_dir):
     intro = get_introspect_files(build_dir)
 
     reconfigure_proj = build_dir / 'Reconfigure_project.vcxproj'
-    proj_contents = ""
-    with open(reconfigure_proj) as f:
-        proj_contents = f.read()
-    proj_options = re.search('<meson(.|\n)*</meson.*>', proj_contents)
-    if proj_options == None:
-        raise Exception("Reading meson options from Reconfigure_project.vcxproj failed")
-    proj_options = proj_options.group(0).split('\n')
+    # Options are the <meson_name> properties of the project which VS edits from the property page
+    option_tag = '{http://schemas.microsoft.com/developer/msbuild/2003}meson_'
+    options_found = False
     changed_options = []
-    for opt in proj_options:
-        opt_name = re.search("(?<=(</meson_)).*(?=(>))", opt)
-        opt_value = re.search("(?<=(>)).*(?=(</))", opt)
-        if opt_name is None or opt_value is None:
+    for _, element in ElementTree.iterparse(reconfigure_proj):
+        if not element.tag.startswith(option_tag):
             continue
-        opt_name = opt_name.group(0).replace("__", ".").replace("--", ":")
-        opt_value = opt_value.group(0)
+        options_found = True
+        opt_name = element.tag[len(option_tag) :].replace("__", ".").replace("--", ":")
+        opt_value = element.text or ''
         if opt_value != str(intro['buildoptions'][opt_name]['value']):
             changed_options.append(f'-D{opt_name}=\"{opt_value}\"')
+    if not options_found:
+        raise Exception("Reading meson options from Reconfigure_project.vcxproj failed")
     meson = get_meson_command(build_dir)
     if changed_options != []:
         configure = f'{meson} configure {" ".join(changed_options)}'
@@ -322,8 +400,261 @@ def run_reconfigure(build_dir):
         print(subprocess.check_output(configure, cwd=build_dir).decode('utf-8').replace('\r', ''))
     print(subprocess.check_output(f'ninja build.ninja', cwd=build_dir).decode('utf-8').replace('\r', ''))
 
+
+def get_build_proj_hash(
+    proj: VcxProj,
+    target: BuildTarget,
+    deps_signature,
+    build_dir: Path,
+    private_dir: Path,
+    source_dir: str,
+    platform: str,
+    build_type: str,
+    platform_toolset: str,
+    cpp_std: str,
+    c_std: str,
+) -> str:
+    # Hash of everything the project is generated from. Headers are represented by the signature of
+    # the ninja deps log because reading them from ninja is the slowest part of the generation.
+    return hashlib.blake2b(
+        repr(
+            (
+                vars(proj),
+                vars(target),
+                deps_signature,
+                str(build_dir),
+                str(private_dir),
+                source_dir,
+                platform,
+                build_type,
+                platform_toolset,
+                cpp_std,
+                c_std,
+                sys.executable,
+                os.stat(__file__).st_mtime_ns,
+            )
+        ).encode('utf-8')
+    ).hexdigest()
+
+
+def get_current_include_props(proj: VcxProj, target: BuildTarget, build_dir: Path, private_dir: Path, proj_hash: str):
+    # Returns the include property sheet of the project if the project is up to date so that writing
+    # it can be skipped and VS does not need to reload it. The hash file also has the name of the sheet
+    # so that the project is regenerated if the sheet is missing.
+    proj_path = Path(f'{build_dir}/{proj.id}.vcxproj')
+    filter_path = Path(f'{build_dir}/{target.id}.vcxproj.filters')
+    hash_path = Path(private_dir) / f'{proj.id}.hash'
+    if proj_path.exists() and filter_path.exists() and hash_path.exists():
+        stored_hash, _, include_props_name = hash_path.read_text(encoding='utf-8', errors='replace').partition('\n')
+        if stored_hash == proj_hash and (Path(private_dir) / include_props_name).is_file():
+            return include_props_name
+    return None
+
+
+def generate_build_proj(
+    proj: VcxProj,
+    target: BuildTarget,
+    headers: T.List[str],
+    build_dir: Path,
+    private_dir: Path,
+    source_dir: str,
+    platform: str,
+    build_type: str,
+    platform_toolset: str,
+    cpp_std: str,
+    c_std: str,
+    proj_hash: str,
+):
+    proj_path = Path(f'{build_dir}/{proj.id}.vcxproj')
+    filter_path = Path(f'{build_dir}/{target.id}.vcxproj.filters')
+    hash_path = Path(private_dir) / f'{proj.id}.hash'
+
+    proj_parts = []
+    proj_parts.append(vs_header_tmpl.format(configuration=build_type, platform=platform))
+    proj_parts.append(vs_globals_tmpl.format(guid=proj.guid, platform=platform, name=proj.name))
+    proj_parts.append(vs_config_tmpl.format(config_type="Utility", platform_toolset=platform_toolset))
+    # VS requires some contents in the project to be able to build it so a .dummy file is included for that
+    # but it is not created so that VS always rebuilds the target when starting debugger
+    proj_id_basename = os.path.basename(proj.id)
+    proj_temp_dir = f'{proj_id_basename}_temp'
+    proj_content_file = f'run_{proj_id_basename}.dummy'
+    proj_content = f'{proj_temp_dir}\\{proj_content_file}'
+
+    proj_parts.append(
+        vs_propertygrp_tmpl.format(
+            out_dir='.\\', intermediate_dir=f'.\\{proj_temp_dir}\\', output=f'{os.path.basename(target.output)}'
+        )
+    )
+
+    # Single project builds are skipped when building whole solution by creating
+    # a temp file, wait 200ms and check if there is more than 1 temp file. If there
+    # is, it indicates that are other projects building simultaneously and the whole
+    # solution will be built by separate ninja project. If there is still only 1 temp
+    # file, the project has been started alone and ninja will build only that project
+    ninja = f'{NINJA_CMD} -C &quot;{build_dir}&quot;'
+    compile = f'''
+&quot;{sys.executable}&quot; {private_dir}\\parallel_sleep.py &quot;{target.name}&quot;
+if %ERRORLEVEL% == 1 ({ninja} &quot;{target.output}&quot;) else (exit /b 0)
+'''
+    proj_parts.append(
+        vs_custom_itemgroup_tmpl.format(
+            command=compile,
+            additional_inputs="",
+            output=target.output,
+            contents=proj_content,
+            verify_io=False,
+            cpp_std=cpp_std,
+            c_std=c_std,
+        )
+    )
+
+    # Sources in json are per-language so collect all languages in case of mixed c & cpp. Adding all
+    # options to project settings is wrong but intellisense does not work properly if the settings
+    # are added only to file
+    all_src = []
+    all_include_paths = []
+    all_preprocessor_macros = []
+    all_additional_options = []
+    lang_src = {}
+    for target_src in target.target_sources:
+        if 'compiler' not in target_src:
+            continue
+        lang = target_src['language']
+        includes = []
+        defines = []
+        additional_options = []
+        # Parameters are classified by their two character prefix
+        prefix_params = {'-I': includes, '/I': includes, '-D': defines, '/D': defines}
+        for par in target_src['parameters']:
+            params = prefix_params.get(par[:2])
+            if params is None:
+                additional_options.append(par)
+            else:
+                params.append(par[2:])
+        preprocessor_macros = [define.replace("\"", "&quot;") for define in defines]
+        all_include_paths.extend(includes)
+        all_preprocessor_macros.extend(preprocessor_macros)
+        all_additional_options.extend(additional_options)
+        lang_src[lang] = {
+            'language': lang,
+            'includes': includes,
+            'preprocessor_macros': preprocessor_macros,
+            'additional_options': additional_options,
+            'sources': target_src['sources'] + target_src['generated_sources'],
+        }
+    # Targets often share the same long list of include paths so the list is written to a property
+    # sheet named by its hash that all of those targets import. The projects only refer to the property.
+    joined_include_paths = ";".join(all_include_paths)
+    include_props = hashlib.blake2b(joined_include_paths.encode('utf-8'), digest_size=8).hexdigest()
+    include_props_path = Path(private_dir) / f'include_{include_props}.props'
+    if not include_props_path.is_file():
+        # Projects are generated in parallel so the sheet is written to a file of its own and moved in
+        # place. An interrupted run can then never leave a truncated sheet behind.
+        tmp_props_path = include_props_path.with_name(f'{include_props_path.name}.{os.getpid()}.tmp')
+        tmp_props_path.write_text(vs_include_props_tmpl.format(include_paths=joined_include_paths), encoding='utf-8')
+        os.replace(tmp_props_path, include_props_path)
+    proj_parts.append(f'''
+\t<Import Project="{include_props_path}"/>
+\t<PropertyGroup>
+\t\t<IncludePath>$(NinjaVsIncludePath);$(VC_IncludePath);$(WindowsSDK_IncludePath);$(IncludePath)</IncludePath>
+\t</PropertyGroup>
+''')
+
+
+    # Files
+    proj_parts.append('\t<ItemGroup>\n')
+    # For extra files use union of includes and preprocessor macros because the real values depend on the source file
+    # so it is possible that same header is included with different macros. Some include paths need to be set to the
+    # header because otherwise intellisense cannot jump from header to another header
+    # Everything except the file name is same for all of them
+    include_settings = (
+        f'">\n\t\t\t<AdditionalIncludeDirectories>$(NinjaVsIncludePath);%(AdditionalIncludeDirectories)</AdditionalIncludeDirectories>\n'
+        f'\t\t\t<PreprocessorDefinitions>{";".join(all_preprocessor_macros)};%(PreprocessorDefinitions)</PreprocessorDefinitions>\n'
+        '\t\t</CLInclude>\n'
+    )
+    # A header can be both in extra files and in the ones found from ninja so duplicates are removed
+    # while keeping the order
+    include_files = dict.fromkeys(itertools.chain(target.extra_files, headers))
+    proj_parts.extend(f'\t\t<CLInclude Include="{src}{include_settings}' for src in include_files)
+    # The lang_src contains language specific settings
+    for _, lang in lang_src.items():
+        # Settings are joined once per language instead of once per source
+        compile_settings = (
+            f'">\n\t\t\t<AdditionalIncludeDirectories>{";".join(lang["includes"])};%(AdditionalIncludeDirectories)</AdditionalIncludeDirectories>\n'
+            f'\t\t\t<PreprocessorDefinitions>{";".join(lang["preprocessor_macros"])};%(PreprocessorDefinitions)</PreprocessorDefinitions>\n'
+            f'\t\t\t<AdditionalOptions>{" ".join(lang["additional_options"])} %(AdditionalOptions)</AdditionalOptions>\n'
+            '\t\t</ClCompile>\n'
+        )
+        all_src.extend(lang['sources'])
+        proj_parts.extend(f'\t\t<ClCompile Include="{src}{compile_settings}' for src in lang['sources'])
+    proj_parts.append('\t</ItemGroup>\n')
+
+    proj_parts.append(vs_end_proj_tmpl)
+    write_utf8(proj_path, proj_parts)
+
+    ###############
+    # Add filters to have folder structure
+    ###############
+    # Collect paths for filters. Folder of each file is computed only once and many files share
+    # the same folder so the rest of the work is done once per folder.
+    dirname = os.path.dirname
+    relpath = os.path.relpath
+    src_dirs = {src: dirname(relpath(src, source_dir)) for src in itertools.chain(all_src, headers)}
+    unique_src_dirs = set(src_dirs.values())
+    src_paths = set()
+    # Sorted so that parent folders come before their subfolders
+    for path in sorted(unique_src_dirs):
+        # All intermediate folders need to be added as well if there are
+        # subfolders with more folders but no files. The walk up stops at the first
+        # folder that is already added because its parents have been added with it.
+        # relpath has already normalized the path so it can be split as is.
+        parent = path
+        while parent and parent not in src_paths:
+            src_paths.add(parent)
+            parent = parent.rpartition(os.sep)[0]
+
+    filter_parts = [vs_start_filter]
+    filter_folder = os.path.relpath(os.path.dirname(f'{build_dir}/{target.id}'), build_dir)
+
+    # Folders relative to the project folder are needed both for the filter folders and the files
+    item_filters = {path: relpath(path, filter_folder) for path in src_paths if path != ""}
+
+    # Create filter folders
+    filter_parts.append('\t<ItemGroup>\n')
+    # Sorted so that the filters file does not change between generations
+    for src_path in sorted(item_filters.values()):
+        if src_path.startswith("."):
+            continue
+        # Same folder gets the same GUID on every generation so that VS does not see the filters changing
+        filter_parts.append(vs_filter_tmpl.format(path=src_path, guid=generate_guid_from_path(src_path)))
+    filter_parts.append('\t</ItemGroup>\n')
+
+    # Add files to correct folder
+    filter_parts.append('\t<ItemGroup>\n')
+    append = filter_parts.append
+    get_item_filter = item_filters.get
+    for item, files in (('ClCompile', all_src), ('ClInclude', headers)):
+        for f in files:
+            item_filter = get_item_filter(src_dirs[f])
+            if item_filter is None:
+                continue
+            append(f'\t\t<{item} Include="{f}">\n\t\t\t<Filter>{item_filter}</Filter>\n\t\t</{item}>\n')
+    filter_parts.append('\t</ItemGroup>\n')
+    filter_parts.append('</Project>\n')
+    write_utf8(filter_path, filter_parts)
+
+    hash_path.parent.mkdir(parents=True, exist_ok=True)
+    hash_path.write_text(f'{proj_hash}\n{include_props_path.name}', encoding='utf-8')
+    return include_props_path.name
+
+
+def _generate_build_proj_worker(args):
+    return generate_build_proj(*args)
+
+
 class VisualStudioSolution:
     def __init__(self, build_dir):
+        is_file.cache_clear()
         self.build_dir = Path(build_dir)
         if not (Path(build_dir).is_absolute()):
             self.build_dir = self.build_dir.absolute()
@@ -343,12 +674,16 @@ class VisualStudioSolution:
 
         self.intro = get_introspect_files(self.build_dir)
         self.build_type = self.intro['buildoptions']['buildtype']['value']
+        self.cpp_std = self.intro['buildoptions'].get('cpp_std', {}).get('value', 'Default')
+        self.c_std = self.intro['buildoptions'].get('c_std', {}).get('value', 'Default')
+        self.platform_toolset = get_platform_toolset(self.intro)
         self.source_dir = self.intro['meson_info']['directories']['source']
         self.subdirs = set()
         build_to_run_subdir = "Build to run"
         self.subdirs.add(build_to_run_subdir)
 
-        self.headers = get_headers(self.intro)
+        # Headers are read from ninja only if some build target project needs to be written
+        self._headers = None
 
         # Install
         install_proj = VcxProj(
@@ -398,8 +733,10 @@ class VisualStudioSolution:
         self.vcxprojs.append(self.prebuild_proj)
 
         # Individual build targets
+        build_projs = []
+        src_prefix = dir_prefix(self.source_dir)
         for target in self.intro['targets']:
-            subdir = os.path.dirname(os.path.relpath(target['defined_in'], self.source_dir))
+            subdir = os.path.dirname(relpath_in_dir(target['defined_in'], src_prefix))
             self.subdirs.add(subdir)
             guid = generate_guid_from_path(self.build_dir / target['id'])
             vcxproj = VcxProj(
@@ -414,7 +751,52 @@ class VisualStudioSolution:
             if vcxproj.is_run_target:
                 self.generate_run_proj(vcxproj, f'{NINJA_CMD} -C &quot;{self.build_dir}&quot; {target["name"]}')
             else:
-                self.generate_build_proj(vcxproj, BuildTarget(target, guid, self.build_dir))
+                build_projs.append((vcxproj, BuildTarget(target, guid, self.build_dir)))
+        # Projects whose inputs have not changed since the previous generation are skipped. The
+        # headers are not part of that check but the ninja deps log they are read from is, so ninja
+        # is asked for the headers only if some project needs to be written.
+        ninja_deps = self.build_dir / '.ninja_deps'
+        deps_signature = None
+        if ninja_deps.exists():
+            deps_stat = ninja_deps.stat()
+            deps_signature = (deps_stat.st_mtime_ns, deps_stat.st_size)
+        proj_settings = (
+            self.build_dir,
+            self.private_dir,
+            self.source_dir,
+            self.platform,
+            self.build_type,
+            self.platform_toolset,
+            self.cpp_std,
+            self.c_std,
+        )
+        used_include_props = set()
+        build_proj_args = []
+        for vcxproj, target in build_projs:
+            proj_hash = get_build_proj_hash(vcxproj, target, deps_signature, *proj_settings)
+            include_props_name = get_current_include_props(vcxproj, target, self.build_dir, self.private_dir, proj_hash)
+            if include_props_name is not None:
+                used_include_props.add(include_props_name)
+            else:
+                build_proj_args.append((vcxproj, target, self.headers[target.name], *proj_settings, proj_hash))
+        # Build projects are independent of each other so they are generated in parallel
+        # Starting a worker process on Windows costs more than generating a single project so the
+        # pool is not larger than the number of projects and is skipped entirely for one project
+        workers = min(os.cpu_count() or 1, len(build_proj_args))
+        if sys.platform == 'win32':
+            # ProcessPoolExecutor does not allow more than 61 workers on Windows
+            workers = min(workers, 61)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Projects are sent in chunks to reduce the pickling round trips
+                chunksize = max(1, len(build_proj_args) // (workers * 4))
+                used_include_props.update(executor.map(_generate_build_proj_worker, build_proj_args, chunksize=chunksize))
+        else:
+            used_include_props.update(_generate_build_proj_worker(proj_args) for proj_args in build_proj_args)
+        # Remove include property sheets that no project uses anymore and leftovers of interrupted writes
+        for include_props_path in self.private_dir.glob('include_*'):
+            if include_props_path.name not in used_include_props:
+                include_props_path.unlink()
         # Regen
         regen_proj = VcxProj(
             "Regenerate solution",
@@ -440,11 +822,17 @@ class VisualStudioSolution:
         self.generate_run_proj(self.ninja_proj, ninja_cmd, [regen_proj])
         self.generate_solution(self.intro['projectinfo']['descriptive_name'] + '.sln')
 
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = get_headers(self.intro)
+        return self._headers
+
     def generate_basic_custom_build(self, proj, command, additional_inputs="", verify_io=False):
-        proj_file = open(f'{self.build_dir}/{proj.id}.vcxproj', 'w', encoding='utf-8')
-        proj_file.write(vs_header_tmpl.format(configuration=self.build_type, platform=self.platform))
-        proj_file.write(vs_globals_tmpl.format(guid=proj.guid, platform=self.platform, name=proj.name))
-        proj_file.write(vs_config_tmpl.format(config_type="Utility", platform_toolset=get_platform_toolset(self.intro)))
+        proj_parts = []
+        proj_parts.append(vs_header_tmpl.format(configuration=self.build_type, platform=self.platform))
+        proj_parts.append(vs_globals_tmpl.format(guid=proj.guid, platform=self.platform, name=proj.name))
+        proj_parts.append(vs_config_tmpl.format(config_type="Utility", platform_toolset=self.platform_toolset))
         # VS requires some contents in the project to be able to build it so a .dummy file is created for that
         proj_id_basename = os.path.basename(proj.id)
         proj_temp_dir = f'{proj_id_basename}_temp'
@@ -458,356 +846,198 @@ class VisualStudioSolution:
         proj_output = f'{proj_temp_dir}\\{proj_output_file}'
         proj_output_abs = proj_temp_dir_abs / proj_output_file
 
-        proj_file.write(
+        proj_parts.append(
             vs_propertygrp_tmpl.format(
                 out_dir='.\\', intermediate_dir=f'.\\{proj_temp_dir}\\', output=f'.\\{proj_id_basename}'
             )
         )
-        proj_file.write(
+        proj_parts.append(
             vs_custom_itemgroup_tmpl.format(
                 command=command,
                 additional_inputs=additional_inputs,
                 output=proj_output,
                 contents=proj_content,
                 verify_io=verify_io,
-                cpp_std=self.intro['buildoptions'].get('cpp_std', {}).get('value', 'Default'),
-                c_std=self.intro['buildoptions'].get('c_std', {}).get('value', 'Default')
+                cpp_std=self.cpp_std,
+                c_std=self.c_std,
             )
         )
-        # Create dummy file and output if needed
-        if not proj_content_abs.exists():
-            if not proj_content_abs.parents[0].exists():
-                os.makedirs(proj_content_abs.parents[0])
-            open(proj_content_abs, 'w', encoding='utf-8').close()
+        # Create dummy file and output if needed. Opening for append creates the file without
+        # touching an existing one
+        os.makedirs(proj_temp_dir_abs, exist_ok=True)
+        open(proj_content_abs, 'a', encoding='utf-8').close()
         if verify_io:
             open(proj_output_abs, 'w', encoding='utf-8').close()
-        return proj_file
+        return proj_parts
 
     def generate_run_proj(self, proj: VcxProj, cmd, dependencies=[]):
-        proj_file = self.generate_basic_custom_build(proj, command=cmd + " $(LocalDebuggerCommandArguments)")
+        proj_parts = self.generate_basic_custom_build(proj, command=cmd + " $(LocalDebuggerCommandArguments)")
 
         # Dependencies
-        proj_file.write('\t<ItemGroup>\n')
+        proj_parts.append('\t<ItemGroup>\n')
         for dep in dependencies:
-            proj_file.write(
+            proj_parts.append(
                 vs_dependency_tmpl.format(vcxproj_name=f'{dep.id}.vcxproj', project_guid=dep.guid, link_deps='false')
             )
-        proj_file.write('\t</ItemGroup>\n')
-        proj_file.write(vs_end_proj_tmpl)
-        proj_file.close()
+        proj_parts.append('\t</ItemGroup>\n')
+        proj_parts.append(vs_end_proj_tmpl)
+        write_utf8(f'{self.build_dir}/{proj.id}.vcxproj', proj_parts)
 
     def generate_regen_proj(self, proj):
-        proj_file = self.generate_basic_custom_build(
+        proj_parts = self.generate_basic_custom_build(
             proj,
             command=f'echo NUL > &quot;{self.tmp_dir}\\regen&quot; \n {NINJA_CMD} build.ninja &amp;&amp; {sys.executable} &quot;{os.path.abspath(__file__)}&quot; --build_root &quot;{self.build_dir}&quot;',
             additional_inputs=";".join(self.intro['buildsystem_files']),
             verify_io=True,
         )
 
-        proj_file.write(vs_end_proj_tmpl)
-        proj_file.close()
+        proj_parts.append(vs_end_proj_tmpl)
+        write_utf8(f'{self.build_dir}/{proj.id}.vcxproj', proj_parts)
 
     def generate_reconfigure_proj(self, proj: VcxProj):
-        # Create rule with options
-        rule = open(f'{self.build_dir}/meson_options.xml', 'w', encoding='utf-8')
-        rule.write(vs_meson_options_rule)
-        rule.write('\t<Rule.Categories>\n')
-        added_categories = []
-        for opt_name, opt in self.intro['buildoptions'].items():
-            category = opt['section']
-            if category not in added_categories:
-                added_categories.append(category)
-                rule.write(f'\t\t<Category Name="{category}" DisplayName="{category}" Description="" />\n')
-        rule.write('\t</Rule.Categories>\n')
-        for opt_name, opt in self.intro['buildoptions'].items():
+        # The options are gone through once. Rule file gets the categories and a property for each
+        # option and the project file gets the current values.
+        # Unique categories in the order they first appear
+        categories = {}
+        rule_parts = []
+        value_parts = []
+        for opt in self.intro['buildoptions'].values():
             opt_name = opt['name'].replace('.', '__').replace(":", "--")
             opt_type = opt['type']
             category = opt['section']
+            categories[category] = None
             if opt_type == 'combo':
-                rule.write(
+                rule_parts.append(
                     f'\t<EnumProperty Name="meson_{opt_name}" DisplayName="{opt["name"]}" Description="{opt["description"]}" Category="{category}">\n'
                 )
                 for choice in opt["choices"]:
-                    rule.write(f'\t\t<EnumValue Name="{choice}" DisplayName="{choice}"/>\n')
-                rule.write(f'\t</EnumProperty>\n')
+                    rule_parts.append(f'\t\t<EnumValue Name="{choice}" DisplayName="{choice}"/>\n')
+                rule_parts.append(f'\t</EnumProperty>\n')
             elif opt_type == 'boolean':
-                rule.write(
+                rule_parts.append(
                     f'\t<EnumProperty Name="meson_{opt_name}" DisplayName="{opt["name"]}" Description="{opt["description"]}" Category="{category}">\n'
                 )
-                rule.write(f'\t\t<EnumValue Name="True" DisplayName="True"/>\n')
-                rule.write(f'\t\t<EnumValue Name="False" DisplayName="False"/>\n')
-                rule.write(f'\t</EnumProperty>\n')
+                rule_parts.append(f'\t\t<EnumValue Name="True" DisplayName="True"/>\n')
+                rule_parts.append(f'\t\t<EnumValue Name="False" DisplayName="False"/>\n')
+                rule_parts.append(f'\t</EnumProperty>\n')
             else:
-                rule.write(
+                rule_parts.append(
                     f'\t<StringProperty Name="meson_{opt_name}" DisplayName="{opt["name"]}" Category="{category}"/>\n'
                 )
-        rule.write('</Rule>')
+            value_parts.append(f'\t\t<meson_{opt_name}>{xml_escape(str(opt["value"]))}</meson_{opt_name}>\n')
+
+        # Create rule with options
+        write_utf8(
+            f'{self.build_dir}/meson_options.xml',
+            [
+                vs_meson_options_rule,
+                '\t<Rule.Categories>\n',
+                *(f'\t\t<Category Name="{category}" DisplayName="{category}" Description="" />\n' for category in categories),
+                '\t</Rule.Categories>\n',
+                *rule_parts,
+                '</Rule>',
+            ],
+        )
 
         # Create the project file
-        proj_file = self.generate_basic_custom_build(
+        proj_parts = self.generate_basic_custom_build(
             proj,
             command=f'{sys.executable} &quot;{os.path.abspath(__file__)}&quot; --reconfigure --build_root=&quot;{self.build_dir}&quot;',
         )
-        proj_file.write('\t<PropertyGroup>\n')
-        for opt_name, opt in self.intro['buildoptions'].items():
-            opt_name = opt["name"].replace(".", "__").replace(":", "--")
-            proj_file.write(f'\t\t<meson_{opt_name}>{opt["value"]}</meson_{opt_name}>\n')
-        proj_file.write('\t\t<UseDefaultPropertyPageSchemas>false</UseDefaultPropertyPageSchemas>')
-        proj_file.write('\t</PropertyGroup>\n')
-        proj_file.write(vs_include_meson_options)
-
-        proj_file.write(vs_end_proj_tmpl)
-        proj_file.close()
-
-    def generate_build_proj(self, proj: VcxProj, target : BuildTarget):
-        proj_file = open(f'{self.build_dir}/{proj.id}.vcxproj', 'w', encoding='utf-8')
-        proj_file.write(vs_header_tmpl.format(configuration=self.build_type, platform=self.platform))
-        proj_file.write(vs_globals_tmpl.format(guid=proj.guid, platform=self.platform, name=proj.name))
-        proj_file.write(vs_config_tmpl.format(config_type="Utility", platform_toolset=get_platform_toolset(self.intro)))
-        # VS requires some contents in the project to be able to build it so a .dummy file is included for that
-        # but it is not created so that VS always rebuilds the target when starting debugger
-        proj_id_basename = os.path.basename(proj.id)
-        proj_temp_dir = f'{proj_id_basename}_temp'
-        proj_content_file = f'run_{proj_id_basename}.dummy'
-        proj_content = f'{proj_temp_dir}\\{proj_content_file}'
+        proj_parts.append('\t<PropertyGroup>\n')
+        proj_parts.extend(value_parts)
+        proj_parts.append('\t\t<UseDefaultPropertyPageSchemas>false</UseDefaultPropertyPageSchemas>')
+        proj_parts.append('\t</PropertyGroup>\n')
+        proj_parts.append(vs_include_meson_options)
 
-        proj_file.write(
-            vs_propertygrp_tmpl.format(
-                out_dir='.\\', intermediate_dir=f'.\\{proj_temp_dir}\\', output=f'{os.path.basename(target.output)}'
-            )
-        )
+        proj_parts.append(vs_end_proj_tmpl)
+        write_utf8(f'{self.build_dir}/{proj.id}.vcxproj', proj_parts)
 
-        # Single project builds are skipped when building whole solution by creating
-        # a temp file, wait 200ms and check if there is more than 1 temp file. If there
-        # is, it indicates that are other projects building simultaneously and the whole
-        # solution will be built by separate ninja project. If there is still only 1 temp
-        # file, the project has been started alone and ninja will build only that project
-        ninja = f'{NINJA_CMD} -C &quot;{self.build_dir}&quot;'
-        compile = f'''
-&quot;{sys.executable}&quot; {self.private_dir}\\parallel_sleep.py &quot;{target.name}&quot;
-if %ERRORLEVEL% == 1 ({ninja} &quot;{target.output}&quot;) else (exit /b 0)
-'''
-        proj_file.write(
-            vs_custom_itemgroup_tmpl.format(
-                command=compile,
-                additional_inputs="",
-                output=target.output,
-                contents=proj_content,
-                verify_io=False,
-                cpp_std=self.intro['buildoptions'].get('cpp_std', {}).get('value', 'Default'),
-                c_std=self.intro['buildoptions'].get('c_std', {}).get('value', 'Default')
-            )
+    def generate_solution(self, sln_filename):
+        sln = io.StringIO()
+        write = sln.write
+        projs = self.vcxprojs
+        prebuild_proj = self.prebuild_proj
+        cfg = f'{self.build_type}|{self.platform}'
+        write('Microsoft Visual Studio Solution File, Format Version 12.00\n')
+        write('# Visual Studio 2019\n')
+        # Add prebuild as a dependency to all other projects
+        prebuild_dep = (
+            '\tProjectSection(ProjectDependencies) = postProject\n'
+            f'\t\t{{{prebuild_proj.guid}}} = {{{prebuild_proj.guid}}}\n'
+            '\tEndProjectSection\n'
         )
-
-        # Sources in json are per-language so collect all languages in case of mixed c & cpp. Adding all
-        # options to project settings is wrong but intellisense does not work properly if the settings
-        # are added only to file
-        all_src = []
-        all_include_paths = []
-        all_preprocessor_macros = []
-        all_additional_options = []
-        lang_src = {}
-        for target_src in target.target_sources:
-            if 'compiler' not in target_src:
-                continue
-            lang = target_src['language']
-            lang_src[lang] = {}
-            lang_src[lang]['language'] = lang
-            lang_src[lang]['includes'] = []
-            lang_src[lang]['preprocessor_macros'] = []
-            lang_src[lang]['additional_options'] = []
-            for par in target_src['parameters']:
-                if par.startswith('-I') or par.startswith('/I'):
-                    all_include_paths.append(par[2:])
-                    lang_src[lang]['includes'].append(par[2:])
-                elif par.startswith('-D') or par.startswith('/D'):
-                    define = par[2:].replace("\"", "&quot;")
-                    all_preprocessor_macros.append(define)
-                    lang_src[lang]['preprocessor_macros'].append(define)
-                else:
-                    all_additional_options.append(par)
-                    lang_src[lang]['additional_options'].append(par)
-            lang_src[lang]['sources'] = target_src['sources'] + target_src['generated_sources']
-        proj_file.write(f'''
-\t<PropertyGroup>
-\t\t<IncludePath>{";".join(all_include_paths)};$(VC_IncludePath);$(WindowsSDK_IncludePath);$(IncludePath)</IncludePath>
-\t</PropertyGroup>
-''')
-
-
-        # Files
-        proj_file.write('\t<ItemGroup>\n')
-        # For extra files use union of includes and preprocessor macros because the real values depend on the source file
-        # so it is possible that same header is included with different macros. Some include paths need to be set to the
-        # header because otherwise intellisense cannot jump from header to another header
-        for src in target.extra_files + self.headers[target.name]:
-            proj_file.write(f'\t\t<CLInclude Include="{src}">\n')
-            proj_file.write(
-                f'\t\t\t<AdditionalIncludeDirectories>{";".join(all_include_paths)};%(AdditionalIncludeDirectories)</AdditionalIncludeDirectories>\n'
-            )
-            proj_file.write(
-                f'\t\t\t<PreprocessorDefinitions>{";".join(all_preprocessor_macros)};%(PreprocessorDefinitions)</PreprocessorDefinitions>\n'
-            )
-            proj_file.write(f'\t\t</CLInclude>\n')
-        # The lang_src contains language specific settings
-        for _, lang in lang_src.items():
-            for src in lang['sources']:
-                all_src.append(src)
-                proj_file.write(f'\t\t<ClCompile Include="{src}">\n')
-                proj_file.write(
-                    f'\t\t\t<AdditionalIncludeDirectories>{";".join(lang["includes"])};%(AdditionalIncludeDirectories)</AdditionalIncludeDirectories>\n'
-                )
-                proj_file.write(
-                    f'\t\t\t<PreprocessorDefinitions>{";".join(lang["preprocessor_macros"])};%(PreprocessorDefinitions)</PreprocessorDefinitions>\n'
-                )
-                proj_file.write(
-                    f'\t\t\t<AdditionalOptions>{" ".join(lang["additional_options"])} %(AdditionalOptions)</AdditionalOptions>\n'
+        write(
+            ''.join(
+                sln_project_tmpl.format(
+                    type_guid=cpp_guid,
+                    name=proj.name,
+                    id=proj.id,
+                    guid=proj.guid,
+                    deps=prebuild_dep if proj != prebuild_proj else '',
                 )
-                proj_file.write(f'\t\t</ClCompile>\n')
-        proj_file.write('\t</ItemGroup>\n')
-
-        proj_file.write(vs_end_proj_tmpl)
-        proj_file.close()
-
-        ###############
-        # Add filters to have folder structure
-        ###############
-        # Collect paths for filters
-        src_paths = set()
-        for src in all_src + self.headers[target.name]:
-            path = os.path.dirname(os.path.relpath(src, self.source_dir))
-            src_paths.add(path)
-            # All intermediate folders need to be added as well if there are
-            # subfolders with more folders but no files
-            path = os.path.normpath(path)
-            split_path = path.split(os.sep)
-            intermediate_path = split_path[0]
-            src_paths.add(intermediate_path)
-            for p in split_path[1:]:
-                intermediate_path += f'\\{p}'
-                src_paths.add(intermediate_path)
-
-        filter_file = open(f'{self.build_dir}/{target.id}.vcxproj.filters', 'w', encoding='utf-8')
-        filter_file.write(vs_start_filter)
-        filter_folder = os.path.relpath(os.path.dirname(f'{self.build_dir}/{target.id}'), self.build_dir)
-
-        # Create filter folders
-        filter_file.write('\t<ItemGroup>\n')
-        for src_path in src_paths:
-            if src_path == "":
-                continue
-            src_path = os.path.relpath(src_path, filter_folder)
-            if src_path.startswith("."):
-                continue
-            filter_file.write(f'\t\t<Filter Include="{src_path}">\n')
-            filter_file.write(f'\t\t\t<UniqueIdentifier>{{{generate_guid()}}}</UniqueIdentifier>\n')
-            filter_file.write('\t\t</Filter>\n')
-        filter_file.write('\t</ItemGroup>\n')
-
-        # Add files to correct folder
-        filter_file.write('\t<ItemGroup>\n')
-        for f in all_src:
-            filter_path = os.path.dirname(os.path.relpath(f, self.source_dir))
-            if filter_path == "":
-                continue
-            filter_path = os.path.relpath(filter_path, filter_folder)
-            filter_file.write(f'\t\t<ClCompile Include="{f}">\n')
-            filter_file.write(f'\t\t\t<Filter>{filter_path}</Filter>\n')
-            filter_file.write(f'\t\t</ClCompile>\n')
-        for h in self.headers[target.name]:
-            filter_path = os.path.dirname(os.path.relpath(h, self.source_dir))
-            if filter_path == "":
-                continue
-            filter_path = os.path.relpath(filter_path, filter_folder)
-            filter_file.write(f'\t\t<ClInclude Include="{h}">\n')
-            filter_file.write(f'\t\t\t<Filter>{filter_path}</Filter>\n')
-            filter_file.write(f'\t\t</ClInclude>\n')
-        filter_file.write('\t</ItemGroup>\n')
-        filter_file.write('</Project>\n')
-
-    def generate_solution(self, sln_filename):
-        sln = open(f'{self.build_dir}/{sln_filename}', 'w', encoding='utf-8')
-        sln.write('Microsoft Visual Studio Solution File, Format Version 12.00\n')
-        sln.write('# Visual Studio 2019\n')
-        for proj in self.vcxprojs:
-            sln.write(f'Project("{cpp_guid}") = "{proj.name}", "{proj.id}.vcxproj", "{{{proj.guid}}}"\n')
-            # Add prebuild as a dependency to all other projects
-            if proj != self.prebuild_proj:
-                sln.write('\tProjectSection(ProjectDependencies) = postProject\n')
-                sln.write(f'\t\t{{{self.prebuild_proj.guid}}} = {{{self.prebuild_proj.guid}}}\n')
-                sln.write('\tEndProjectSection\n')
-            sln.write('EndProject\n')
-        # Targets in correct subfolder
+                for proj in projs
+            )
+        )
+        # Targets in correct subfolder. The folders including all intermediate folders are
+        # collected with their GUIDs
         subdir_guids = {}
-        subsubdir_parents = {}
-        expanded_subdirs = set()
         for dir in self.subdirs:
-            dir = dir
             if dir == '':
                 continue
+            if '\\' not in dir:
+                subdir_guids[dir] = generate_guid_from_path(dir)
+                continue
             split_dir = dir.split('\\')
-            base = split_dir[0]
-            if len(split_dir) > 1:
-                expanded_subdirs.add(base)
-                parent = base
-                for i in range(1, len(split_dir)):
-                    sub = base
-                    for j in range(1, i + 1):
-                        sub += "\\" + split_dir[j]
-                    expanded_subdirs.add(sub)
-                    subsubdir_parents[sub] = parent
-                    parent = sub
-            else:
-                expanded_subdirs.add(dir)
-        for dir in expanded_subdirs:
-            guid = generate_guid_from_path(dir)
-            subdir_guids[dir] = guid
-            dirname = dir.split('\\')[-1]
-            sln.write(f'Project("{directory_guid}") = "{dirname}", "{dirname}", "{{{guid}}}"\n')
-            sln.write('EndProject\n')
-        sln.write('Global\n')
-        sln.write('\tGlobalSection(SolutionConfigurationPlatforms) = preSolution\n')
-        sln.write(f'\t\t{self.build_type}|{self.platform} = {self.build_type}|{self.platform}\n')
-        sln.write('\tEndGlobalSection\n')
-
-        sln.write('\tGlobalSection(ProjectConfigurationPlatforms) = postSolution\n')
-        for proj in self.vcxprojs:
-            sln.write(
-                f'\t\t{{{proj.guid}}}.{self.build_type}|{self.platform}.ActiveCfg = {self.build_type}|{self.platform}\n'
-            )
-            if proj.build_by_default:
-                sln.write(
-                    f'\t\t{{{proj.guid}}}.{self.build_type}|{self.platform}.Build.0 = {self.build_type}|{self.platform}\n'
-                )
-        sln.write('\tEndGlobalSection\n')
+            # Each intermediate folder is its parent with one more component
+            parent = split_dir[0]
+            subdir_guids[parent] = generate_guid_from_path(parent)
+            for component in split_dir[1:]:
+                parent = parent + '\\' + component
+                subdir_guids[parent] = generate_guid_from_path(parent)
+        # Sorted so that the solution file does not change between generations. Sorting also places
+        # parent folders before their subfolders.
+        folder_projects = []
+        # (child guid, parent guid) of nested folders
+        subsubdir_parents = []
+        for dir, guid in sorted(subdir_guids.items()):
+            parent, _, dirname = dir.rpartition('\\')
+            folder_projects.append(f'Project("{directory_guid}") = "{dirname}", "{dirname}", "{{{guid}}}"\nEndProject\n')
+            if parent:
+                subsubdir_parents.append((guid, subdir_guids[parent]))
+        write(''.join(folder_projects))
+        write('Global\n')
+        write('\tGlobalSection(SolutionConfigurationPlatforms) = preSolution\n')
+        write(f'\t\t{cfg} = {cfg}\n')
+        write('\tEndGlobalSection\n')
+
+        write('\tGlobalSection(ProjectConfigurationPlatforms) = postSolution\n')
+        # Every project has an active configuration but only the ones built by default are in the build.
+        # Only the GUID changes between the lines.
+        active_cfg_suffix = f'}}.{cfg}.ActiveCfg = {cfg}\n'
+        build_cfg_suffix = f'}}.{cfg}.Build.0 = {cfg}\n'
+        write(''.join(['\t\t{' + proj.guid + active_cfg_suffix for proj in projs]))
+        write(''.join(['\t\t{' + proj.guid + build_cfg_suffix for proj in projs if proj.build_by_default]))
+        write('\tEndGlobalSection\n')
 
         # Run targets in "Build to run" folder
-        sln.write('\tGlobalSection(NestedProjects) = preSolution\n')
-        for proj in self.vcxprojs:
-            if proj.subdir != '':
-                sln.write(f'\t\t{{{proj.guid}}} = {{{subdir_guids[proj.subdir]}}}\n')
-        for subdir, parent in subsubdir_parents.items():
-            sln.write(f'\t\t{{{subdir_guids[str(subdir)]}}} = {{{subdir_guids[str(parent)]}}}\n')
-        sln.write('\tEndGlobalSection\n')
-
-        sln.write('\tGlobalSection(SolutionProperties) = preSolution\n')
-        sln.write('\t\tHideSolutionNode = FALSE\n')
-        sln.write('\tEndGlobalSection\n')
-        sln.write('EndGlobal\n')
-        sln.close()
+        write('\tGlobalSection(NestedProjects) = preSolution\n')
+        write(''.join([f'\t\t{{{proj.guid}}} = {{{subdir_guids[proj.subdir]}}}\n' for proj in projs if proj.subdir != '']))
+        write(''.join([f'\t\t{{{child_guid}}} = {{{parent_guid}}}\n' for child_guid, parent_guid in subsubdir_parents]))
+        write('\tEndGlobalSection\n')
+
+        write('\tGlobalSection(SolutionProperties) = preSolution\n')
+        write('\t\tHideSolutionNode = FALSE\n')
+        write('\tEndGlobalSection\n')
+        write('EndGlobal\n')
+        with open(f'{self.build_dir}/{sln_filename}', 'w', encoding='utf-8', buffering=1 << 17) as f:
+            f.write(sln.getvalue())
 
     def generate_python_sleep_script(self):
-        sleep_script = open(self.private_dir / 'parallel_sleep.py', 'w')
         tmp_dir_forward_slash = str(self.tmp_dir).replace('\\', '/')
-        sleep_script.write(f'''
-import time;
-import os;
-import sys;
-open(f"{tmp_dir_forward_slash}/{{sys.argv[1]}}", "w").close()
-if len(os.listdir("{tmp_dir_forward_slash}")) < 2:
-    time.sleep(0.5)
-sys.exit(len(os.listdir("{tmp_dir_forward_slash}")))
-''')
+        with open(self.private_dir / 'parallel_sleep.py', 'w') as sleep_script:
+            sleep_script.write(parallel_sleep_tmpl.format(tmp_dir=tmp_dir_forward_slash))
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Create Visual Studio solution with ninja backend.')